@@ -0,0 +1,198 @@
+"""Fire simulation, frame encoding and pacing shared by the fire effect scripts.
+
+Each binary message sent to the device is exactly one frame. A raw frame is a
+pixel count byte followed by that many `r, g, b` triplets; a run-length
+encoded frame is `RLE_FLAG | run_count` followed by that many
+`length, r, g, b` runs. Either form describes at most 127 pixels, and the
+device rejects a message with bytes left over after its frame.
+
+Requires the `numpy` and `numba` packages (`pip install numpy numba`).
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import socket
+import time
+from numba import njit
+from queue import Empty, Queue
+from typing import Optional, Tuple
+
+WIDTH = 4
+HEIGHT = 3
+# A frame with no pixels; the device turns the strip off when it gets one.
+CLEAR_FRAME = b"\x00"
+# Set in a frame header when the frame is run-length encoded, which leaves
+# seven bits for the pixel (or run) count.
+RLE_FLAG = 0x80
+MAX_FRAME_PIXELS = RLE_FLAG - 1
+
+
+PALETTE: Tuple[Tuple[int, int, int], ...] = (
+    (0, 0, 0),
+    (7, 0, 0),
+    (15, 0, 0),
+    (31, 0, 0),
+    (47, 7, 0),
+    (71, 15, 0),
+    (95, 23, 0),
+    (119, 31, 0),
+    (143, 47, 0),
+    (159, 63, 0),
+    (175, 79, 0),
+    (191, 95, 0),
+    (207, 111, 0),
+    (223, 127, 0),
+    (239, 143, 0),
+    (255, 159, 0),
+    (255, 175, 0),
+    (255, 191, 0),
+    (255, 207, 0),
+    (255, 215, 31),
+    (255, 223, 63),
+    (255, 231, 95),
+    (255, 239, 127),
+    (255, 247, 159),
+)
+
+# Maps every possible heat value straight to its palette colour.
+PALETTE_LUT = np.array(
+    [PALETTE[(value * (len(PALETTE) - 1)) // 255] for value in range(256)],
+    dtype=np.uint8,
+)
+
+
+@njit(cache=True)
+def _encode_frame(colours: np.ndarray, out: np.ndarray) -> int:
+    """Write ``colours`` into ``out`` as a wire frame and return its length.
+
+    The frame is run-length encoded (``RLE_FLAG | runs`` followed by
+    ``length, r, g, b`` runs) when that is shorter than the raw form (a pixel
+    count followed by ``r, g, b`` triplets).
+    """
+    count = colours.shape[0]
+    raw_len = 1 + 3 * count
+    runs = 0
+    pos = 1
+    start = 0
+    while start < count and pos < raw_len:
+        end = start + 1
+        while (
+            end < count
+            and end - start < 255
+            and colours[end, 0] == colours[start, 0]
+            and colours[end, 1] == colours[start, 1]
+            and colours[end, 2] == colours[start, 2]
+        ):
+            end += 1
+        out[pos] = end - start
+        out[pos + 1] = colours[start, 0]
+        out[pos + 2] = colours[start, 1]
+        out[pos + 3] = colours[start, 2]
+        pos += 4
+        runs += 1
+        start = end
+
+    if pos < raw_len:
+        out[0] = RLE_FLAG | runs
+        return pos
+
+    out[0] = count
+    out[1:raw_len] = colours.ravel()
+    return raw_len
+
+
+@njit(cache=True)
+def _fire_step(
+    heat: np.ndarray,
+    divisors: np.ndarray,
+    lut: np.ndarray,
+    colours: np.ndarray,
+    frame: np.ndarray,
+) -> int:
+    """Advance ``heat`` one frame and encode its colours into ``frame``.
+
+    Each cell's colour is looked up in ``lut`` as soon as its heat is known,
+    so no separate pass over the heat map is needed. Returns the frame length.
+    """
+    # Random draws stay in the kernel: Numba's native randint is a few ns
+    # per call, far cheaper than pre-batching arrays with NumPy from Python.
+    height = heat.shape[0]
+    width = divisors.shape[0]
+    bottom = height - 1
+    for x in range(width):
+        heat[bottom, x + 1] = np.random.randint(160, 256)
+        colours[bottom, x] = lut[heat[bottom, x + 1]]
+
+    for y in range(bottom - 1, -1, -1):
+        below = heat[y + 1]
+        for x in range(width):
+            # The zero padding columns make edge cells sum only two sources.
+            total = below[x] + below[x + 1] + below[x + 2]
+            decay = np.random.randint(10, 36)
+            heat[y, x + 1] = max(total // divisors[x] - decay, 0)
+            colours[y, x] = lut[heat[y, x + 1]]
+
+    return _encode_frame(colours.reshape(-1, 3), frame)
+
+
+class FireEffect:
+    def __init__(self, width: int, height: int) -> None:
+        if width * height > MAX_FRAME_PIXELS:
+            raise ValueError(f"at most {MAX_FRAME_PIXELS} pixels fit in a frame")
+        self.width = width
+        self.height = height
+        # The first and last columns are always-zero padding, so every cell
+        # can sum the three cells below it without bounds checks.
+        self.heat = np.zeros((height, width + 2), dtype=np.int16)
+        # Number of real cells below each column: edges only have two.
+        self._divisors = np.full(width, 3, dtype=np.int16)
+        self._divisors[0] -= 1
+        self._divisors[-1] -= 1
+        self._colours = np.empty((height, width, 3), dtype=np.uint8)
+        # Large enough for a frame in either encoding.
+        self._frame = np.empty(1 + 4 * width * height, dtype=np.uint8)
+
+    def step(self) -> bytes:
+        """Advance the simulation and return the frame encoded for the wire."""
+        length = _fire_step(self.heat, self._divisors, PALETTE_LUT, self._colours, self._frame)
+        return self._frame[:length].tobytes()
+
+
+def tune_socket(sock: socket.socket) -> None:
+    """Send small frames immediately and acknowledge device replies at once."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    quickack(sock)
+
+
+def quickack(sock: socket.socket) -> None:
+    """Arm TCP_QUICKACK where available (Linux).
+
+    The kernel falls back to delayed ACKs on its own, so callers re-arm it
+    after every reply they read.
+    """
+    if hasattr(socket, "TCP_QUICKACK"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+
+def put_latest(queue: "Queue[Optional[bytes]]", item: Optional[bytes]) -> None:
+    """Replace whatever is still waiting in ``queue`` with ``item``."""
+    try:
+        queue.get_nowait()
+    except Empty:
+        pass
+    queue.put_nowait(item)
+
+
+def wait_for_next_frame(deadline: float, interval: float) -> float:
+    """Sleep until ``deadline + interval`` and return that new deadline.
+
+    If the caller has already overrun it, the schedule restarts from now
+    instead of rushing out catch-up frames back to back.
+    """
+    deadline += interval
+    delay = deadline - time.monotonic()
+    if delay <= 0:
+        return time.monotonic()
+    time.sleep(delay)
+    return deadline
@@ -1,83 +1,32 @@
 #!/usr/bin/env python3
-"""Stream a 3x4 fire effect to the Nightstand /params endpoint."""
+"""Stream a 3x4 fire effect to the Nightstand /params endpoint.
+
+Requires the `numpy` and `numba` packages (`pip install numpy numba`).
+"""
 
 from __future__ import annotations
 
 import argparse
-import json
-import random
+import socket
 import time
-from http.client import HTTPConnection, HTTPResponse
-from queue import Empty, Full, Queue
+from functools import lru_cache
+from io import BufferedReader
+from queue import Queue
 from threading import Event, Thread
-from typing import List, Optional, Sequence, Tuple
-
-WIDTH = 4
-HEIGHT = 3
-
-
-PALETTE: Tuple[Tuple[int, int, int], ...] = (
-    (0, 0, 0),
-    (7, 0, 0),
-    (15, 0, 0),
-    (31, 0, 0),
-    (47, 7, 0),
-    (71, 15, 0),
-    (95, 23, 0),
-    (119, 31, 0),
-    (143, 47, 0),
-    (159, 63, 0),
-    (175, 79, 0),
-    (191, 95, 0),
-    (207, 111, 0),
-    (223, 127, 0),
-    (239, 143, 0),
-    (255, 159, 0),
-    (255, 175, 0),
-    (255, 191, 0),
-    (255, 207, 0),
-    (255, 215, 31),
-    (255, 223, 63),
-    (255, 231, 95),
-    (255, 239, 127),
-    (255, 247, 159),
+from typing import Optional
+
+from _fire_core import (
+    CLEAR_FRAME,
+    HEIGHT,
+    WIDTH,
+    FireEffect,
+    put_latest,
+    quickack,
+    tune_socket,
+    wait_for_next_frame,
 )
 
 
-class FireEffect:
-    def __init__(self, width: int, height: int) -> None:
-        self.width = width
-        self.height = height
-        self.heat = [0 for _ in range(width * height)]
-
-    def _idx(self, x: int, y: int) -> int:
-        return y * self.width + x
-
-    def step(self) -> List[Tuple[int, int, int]]:
-        bottom = self.height - 1
-        for x in range(self.width):
-            self.heat[self._idx(x, bottom)] = random.randint(160, 255)
-
-        for y in range(bottom - 1, -1, -1):
-            for x in range(self.width):
-                sources: List[int] = [self.heat[self._idx(x, y + 1)]]
-                if x > 0:
-                    sources.append(self.heat[self._idx(x - 1, y + 1)])
-                if x < self.width - 1:
-                    sources.append(self.heat[self._idx(x + 1, y + 1)])
-                avg = sum(sources) // len(sources)
-                decay = random.randint(10, 35)
-                self.heat[self._idx(x, y)] = max(avg - decay, 0)
-
-        return [self._heat_to_rgb(value) for value in self.heat]
-
-    @staticmethod
-    def _heat_to_rgb(value: int) -> Tuple[int, int, int]:
-        value = max(0, min(255, value))
-        idx = int((value / 255) * (len(PALETTE) - 1))
-        return PALETTE[idx]
-
-
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("host", help="Hostname or IP of the ESP32 board")
@@ -91,72 +40,142 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def post_pixels(host: str, port: int, pixels: Sequence[Tuple[int, int, int]]) -> tuple[int, str, bytes]:
-    payload = json.dumps([{"r": r, "g": g, "b": b} for r, g, b in pixels])
-    headers = {"Content-Type": "application/json", "Content-Length": str(len(payload))}
-    conn = HTTPConnection(host, port, timeout=5)
-    try:
-        conn.request("POST", "/params", body=payload, headers=headers)
-        resp: HTTPResponse = conn.getresponse()
-        return resp.status, resp.reason, resp.read()
-    finally:
-        conn.close()
+@lru_cache(maxsize=None)
+def request_head(host: str, port: int, length: int) -> bytes:
+    """Build the request line and headers for a ``length``-byte POST /params."""
+    authority = host if port == 80 else f"{host}:{port}"
+    return (
+        b"POST /params HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Content-Type: application/octet-stream\r\n"
+        b"Content-Length: %d\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % (authority.encode("ascii"), length)
+
+
+def open_connection(host: str, port: int) -> tuple[socket.socket, BufferedReader]:
+    """Connect to the device and wrap the socket in one long-lived reader."""
+    sock = socket.create_connection((host, port), timeout=5)
+    tune_socket(sock)
+    return sock, sock.makefile("rb")
+
+
+def close_connection(sock: socket.socket, reader: BufferedReader) -> None:
+    reader.close()
+    sock.close()
+
+
+def read_chunked(reader: BufferedReader) -> bytes:
+    parts = []
+    while True:
+        size = int(reader.readline().split(b";", 1)[0], 16)
+        if size == 0:
+            break
+        parts.append(reader.read(size))
+        reader.readline()
+    # Skip any trailers up to the terminating blank line.
+    while reader.readline() not in (b"\r\n", b"\n", b""):
+        pass
+    return b"".join(parts)
+
+
+def read_response(reader: BufferedReader) -> tuple[int, str, bytes]:
+    """Read one response: status line, the framing headers, then the body."""
+    status_line = reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed before a response arrived")
+    _, status, *reason = status_line.split(None, 2)
+    length: Optional[int] = None
+    chunked = False
+    while True:
+        line = reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"transfer-encoding":
+            chunked = b"chunked" in value.lower()
+    if chunked:
+        body = read_chunked(reader)
+    elif length is not None:
+        body = reader.read(length)
+    else:
+        # No framing: the body runs until the device closes the connection.
+        body = reader.read()
+    return int(status), b"".join(reason).decode("latin-1").strip(), body
+
+
+def post_pixels(
+    sock: socket.socket,
+    reader: BufferedReader,
+    host: str,
+    port: int,
+    payload: bytes,
+) -> tuple[int, str, bytes]:
+    sock.sendall(request_head(host, port, len(payload)) + payload)
+    response = read_response(reader)
+    quickack(sock)
+    return response
 
 
 def sender_worker(
     host: str,
     port: int,
-    queue: "Queue[Optional[List[Tuple[int, int, int]]]]",
+    queue: "Queue[Optional[bytes]]",
     stop_event: Event,
 ) -> int:
-    while not stop_event.is_set():
-        try:
-            pixels = queue.get(timeout=0.2)
-        except Empty:
-            continue
-        if pixels is None:
-            break
-        status, reason, body = post_pixels(host, port, pixels)
-        if status != 200:
-            print(f"Server responded {status} {reason}: {body!r}")
-            stop_event.set()
-            return 1
+    sock, reader = open_connection(host, port)
+    try:
+        while True:
+            frame = queue.get()
+            if frame is None:
+                break
+            try:
+                status, reason, body = post_pixels(sock, reader, host, port, frame)
+            except ConnectionError:
+                # The device dropped the kept-alive socket; reopen it once.
+                close_connection(sock, reader)
+                sock, reader = open_connection(host, port)
+                status, reason, body = post_pixels(sock, reader, host, port, frame)
+            if status != 200:
+                print(f"Server responded {status} {reason}: {body!r}")
+                stop_event.set()
+                return 1
+    finally:
+        close_connection(sock, reader)
     return 0
 
 
 def send_clear(host: str, port: int) -> None:
-    payload = json.dumps([])
-    headers = {"Content-Type": "application/json", "Content-Length": str(len(payload))}
-    conn = HTTPConnection(host, port, timeout=5)
+    sock, reader = open_connection(host, port)
     try:
-        conn.request("POST", "/params", body=payload, headers=headers)
-        conn.getresponse()
+        post_pixels(sock, reader, host, port, CLEAR_FRAME)
     finally:
-        conn.close()
+        close_connection(sock, reader)
 
 
 def main() -> int:
     args = parse_args()
     fire = FireEffect(WIDTH, HEIGHT)
-    queue: "Queue[Optional[List[Tuple[int, int, int]]]]" = Queue(maxsize=16)
+    queue: "Queue[Optional[bytes]]" = Queue(maxsize=1)
     stop_event = Event()
 
     worker = Thread(target=sender_worker, args=(args.host, args.port, queue, stop_event), daemon=True)
     worker.start()
 
     try:
+        next_frame = time.monotonic()
         while not stop_event.is_set():
-            pixels = fire.step()
-            try:
-                queue.put(pixels, timeout=0.1)
-            except Full:
-                continue
-            time.sleep(args.interval)
+            put_latest(queue, fire.step())
+            next_frame = wait_for_next_frame(next_frame, args.interval)
     except KeyboardInterrupt:
         pass
     finally:
         stop_event.set()
-        queue.put(None)
+        put_latest(queue, None)
         worker.join()
         send_clear(args.host, args.port)
 
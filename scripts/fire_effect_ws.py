@@ -1,85 +1,35 @@
 #!/usr/bin/env python3
 """Stream a 3x4 fire effect to the Nightstand /ws WebSocket endpoint.
 
-Requires the `websocket-client` package (`pip install websocket-client`).
+Requires the `websocket-client`, `numpy` and `numba` packages
+(`pip install websocket-client numpy numba`).
 """
 
 from __future__ import annotations
 
 import argparse
 import json
-import random
+import socket
 import time
 import websocket
-from queue import Empty, Full, Queue
+from queue import Queue
 from threading import Event, Thread
-from typing import List, Optional, Sequence, Tuple
-
-
-WIDTH = 4
-HEIGHT = 3
-
-
-PALETTE: Tuple[Tuple[int, int, int], ...] = (
-    (0, 0, 0),
-    (7, 0, 0),
-    (15, 0, 0),
-    (31, 0, 0),
-    (47, 7, 0),
-    (71, 15, 0),
-    (95, 23, 0),
-    (119, 31, 0),
-    (143, 47, 0),
-    (159, 63, 0),
-    (175, 79, 0),
-    (191, 95, 0),
-    (207, 111, 0),
-    (223, 127, 0),
-    (239, 143, 0),
-    (255, 159, 0),
-    (255, 175, 0),
-    (255, 191, 0),
-    (255, 207, 0),
-    (255, 215, 31),
-    (255, 223, 63),
-    (255, 231, 95),
-    (255, 239, 127),
-    (255, 247, 159),
+from typing import Optional
+
+from _fire_core import (
+    CLEAR_FRAME,
+    HEIGHT,
+    WIDTH,
+    FireEffect,
+    put_latest,
+    quickack,
+    tune_socket,
+    wait_for_next_frame,
 )
 
-
-class FireEffect:
-    def __init__(self, width: int, height: int) -> None:
-        self.width = width
-        self.height = height
-        self.heat = [0 for _ in range(width * height)]
-
-    def _idx(self, x: int, y: int) -> int:
-        return y * self.width + x
-
-    def step(self) -> List[Tuple[int, int, int]]:
-        bottom = self.height - 1
-        for x in range(self.width):
-            self.heat[self._idx(x, bottom)] = random.randint(160, 255)
-
-        for y in range(bottom - 1, -1, -1):
-            for x in range(self.width):
-                sources: List[int] = [self.heat[self._idx(x, y + 1)]]
-                if x > 0:
-                    sources.append(self.heat[self._idx(x - 1, y + 1)])
-                if x < self.width - 1:
-                    sources.append(self.heat[self._idx(x + 1, y + 1)])
-                avg = sum(sources) // len(sources)
-                decay = random.randint(10, 35)
-                self.heat[self._idx(x, y)] = max(avg - decay, 0)
-
-        return [self._heat_to_rgb(value) for value in self.heat]
-
-    @staticmethod
-    def _heat_to_rgb(value: int) -> Tuple[int, int, int]:
-        value = max(0, min(255, value))
-        idx = int((value / 255) * (len(PALETTE) - 1))
-        return PALETTE[idx]
+# Reconnect delays double after every failed attempt, within these bounds.
+RECONNECT_DELAY_MIN = 0.1
+RECONNECT_DELAY_MAX = 5.0
 
 
 def parse_args() -> argparse.Namespace:
@@ -109,6 +59,7 @@ def build_uri(host: str, port: int, path: str) -> str:
 
 def connect(uri: str) -> websocket.WebSocket:
     ws = websocket.create_connection(uri, timeout=5)
+    tune_socket(ws.sock)
     ws.settimeout(5)
     try:
         msg = ws.recv()
@@ -119,70 +70,99 @@ def connect(uri: str) -> websocket.WebSocket:
     return ws
 
 
-def send_pixels(ws: websocket.WebSocket, pixels: Sequence[Tuple[int, int, int]]) -> None:
-    payload = json.dumps([{"r": r, "g": g, "b": b} for r, g, b in pixels])
-    ws.send(payload)
+def send_frame(ws: websocket.WebSocket, frame: bytes) -> None:
+    ws.send(frame, opcode=websocket.ABNF.OPCODE_BINARY)
+
+
+def read_replies(ws: websocket.WebSocket) -> None:
+    """Drain device replies off the send path, reporting any errors."""
+    while True:
+        try:
+            resp = ws.recv()
+            # An orderly close from the device leaves ``ws.sock`` unset.
+            sock = ws.sock
+            if sock is not None:
+                quickack(sock)
+        except websocket.WebSocketTimeoutException:
+            continue
+        except (websocket.WebSocketException, OSError):
+            return
+        if not resp:
+            continue
+        try:
+            parsed = json.loads(resp)
+        except json.JSONDecodeError:
+            print(f"Non-JSON response: {resp}")
+        else:
+            if parsed.get("error"):
+                print(f"Device reported error: {parsed}")
+
+
+def disconnect(ws: websocket.WebSocket, reader: Thread) -> None:
+    """Close ``ws`` and wait for its reply reader to exit."""
     try:
-        resp = ws.recv()
-        if resp:
-            try:
-                parsed = json.loads(resp)
-            except json.JSONDecodeError:
-                print(f"Non-JSON response: {resp}")
-            else:
-                if parsed.get("error"):
-                    print(f"Device reported error: {parsed}")
-    except websocket.WebSocketTimeoutException:
+        ws.send_close()
+    except (websocket.WebSocketException, OSError):
         pass
+    sock = ws.sock
+    if sock is not None:
+        try:
+            # Wakes the reader if it is blocked in recv().
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    reader.join()
+    ws.shutdown()
 
 
 def websocket_sender(
     uri: str,
-    queue: "Queue[Optional[List[Tuple[int, int, int]]]]",
+    queue: "Queue[Optional[bytes]]",
     stop_event: Event,
 ) -> int:
     ws: Optional[websocket.WebSocket] = None
-    while not stop_event.is_set():
+    reader: Optional[Thread] = None
+    delay = RECONNECT_DELAY_MIN
+    while True:
         if ws is None:
+            if stop_event.is_set():
+                break
             try:
                 ws = connect(uri)
                 print(f"Connected to {uri}")
-            except websocket.WebSocketException as err:
-                print(f"Failed to connect: {err}. Retrying...")
-                time.sleep(1)
+            except (websocket.WebSocketException, OSError) as err:
+                print(f"Failed to connect: {err}. Retrying in {delay:.1f}s...")
+                if stop_event.wait(delay):
+                    break
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
                 continue
+            reader = Thread(target=read_replies, args=(ws,), daemon=True)
+            reader.start()
 
-        try:
-            pixels = queue.get(timeout=0.2)
-        except Empty:
-            continue
-
-        if pixels is None:
+        frame = queue.get()
+        if frame is None:
             break
 
         try:
-            send_pixels(ws, pixels)
+            send_frame(ws, frame)
         except (websocket.WebSocketException, OSError) as err:
-            print(f"WebSocket error: {err}. Reconnecting...")
-            try:
-                queue.put_nowait(pixels)
-            except Full:
-                pass
-            try:
-                ws.close()
-            except Exception:
-                pass
+            # The unsent frame is dropped: by the time the link is back the
+            # generator will have queued a newer frame to send instead.
+            print(f"WebSocket error: {err}. Reconnecting in {delay:.1f}s...")
+            disconnect(ws, reader)
             ws = None
+            if stop_event.wait(delay):
+                break
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
+        else:
+            delay = RECONNECT_DELAY_MIN
 
     if ws is not None:
         try:
-            send_pixels(ws, [])
-        except Exception:
-            pass
-        try:
-            ws.close()
+            send_frame(ws, CLEAR_FRAME)
         except Exception:
             pass
+        disconnect(ws, reader)
 
     return 0
 
@@ -191,25 +171,22 @@ def main() -> int:
     args = parse_args()
     uri = build_uri(args.host, args.port, args.path)
     fire = FireEffect(WIDTH, HEIGHT)
-    queue: "Queue[Optional[List[Tuple[int, int, int]]]]" = Queue(maxsize=16)
+    queue: "Queue[Optional[bytes]]" = Queue(maxsize=1)
     stop_event = Event()
 
     worker = Thread(target=websocket_sender, args=(uri, queue, stop_event), daemon=True)
     worker.start()
 
     try:
+        next_frame = time.monotonic()
         while not stop_event.is_set():
-            pixels = fire.step()
-            try:
-                queue.put(pixels, timeout=0.1)
-            except Full:
-                continue
-            time.sleep(args.interval)
+            put_latest(queue, fire.step())
+            next_frame = wait_for_next_frame(next_frame, args.interval)
     except KeyboardInterrupt:
         pass
     finally:
         stop_event.set()
-        queue.put(None)
+        put_latest(queue, None)
         worker.join()
 
     return 0
@@ -4,9 +4,9 @@
 from __future__ import annotations
 
 import argparse
-import json
 from http.client import HTTPConnection, HTTPResponse
-from typing import List
+
+RED_PIXEL = b'{"r":255,"g":0,"b":0}'
 
 
 def parse_args() -> argparse.Namespace:
@@ -22,12 +22,11 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def make_payload(count: int) -> str:
-    pixels: List[dict[str, int]] = [{"r": 255, "g": 0, "b": 0} for _ in range(count)]
-    return json.dumps(pixels)
+def make_payload(count: int) -> bytes:
+    return b"[" + b",".join([RED_PIXEL] * count) + b"]"
 
 
-def post_pixels(host: str, port: int, payload: str) -> tuple[int, str, bytes]:
+def post_pixels(host: str, port: int, payload: bytes) -> tuple[int, str, bytes]:
     conn = HTTPConnection(host, port, timeout=5)
     try:
         headers = {
@@ -1,4 +1,4 @@
-use std::{convert::TryInto, sync::mpsc::Sender};
+use std::{convert::TryInto, iter, sync::mpsc::Sender};
 
 use anyhow::{anyhow, Result};
 use embedded_svc::{http::Method, io::Write, ws::FrameType};
@@ -16,6 +16,10 @@ use crate::ws2812::neopixel::Rgb;
 
 const MAX_PARAM_LEN: usize = 512;
 const HTTP_STACK_SIZE: usize = 8192;
+/// Set in a binary frame header when the frame is run-length encoded.
+const RLE_FLAG: u8 = 0x80;
+/// Most pixels a binary frame may decode to; the largest raw frame header.
+const MAX_FRAME_PIXELS: usize = 0x7f;
 
 pub fn connect_wifi(
     modem: Modem,
@@ -93,7 +97,7 @@ fn register_http_handlers(
             }
         };
 
-        match frame_type {
+        let is_text = match frame_type {
             FrameType::Ping => {
                 ws.send(FrameType::Pong, &[])?;
                 return Ok(());
@@ -105,29 +109,20 @@ fn register_http_handlers(
                 warn!("Ignoring fragmented frame from session {}", ws.session());
                 return Ok(());
             }
-            FrameType::Binary(_) => {
-                if raw_len > 0 {
-                    let mut drain = vec![0u8; raw_len];
-                    ws.recv(&mut drain)?;
-                }
-                warn!(
-                    "Binary WebSocket frames not supported (session {})",
-                    ws.session()
-                );
-                ws.send(
-                    FrameType::Text(false),
-                    b"{\"error\":\"binary_not_supported\"}",
-                )?;
-                return Ok(());
-            }
-            FrameType::Text(_) => {}
-        }
+            FrameType::Binary(_) => false,
+            FrameType::Text(_) => true,
+        };
 
         if raw_len == 0 {
             return Ok(());
         }
 
-        let payload_len = raw_len.saturating_sub(1);
+        // Text frames are received with a trailing NUL terminator.
+        let payload_len = if is_text {
+            raw_len.saturating_sub(1)
+        } else {
+            raw_len
+        };
 
         if payload_len > MAX_PARAM_LEN {
             let mut discard = vec![0u8; raw_len];
@@ -140,19 +135,26 @@ fn register_http_handlers(
 
         let mut payload = vec![0u8; raw_len];
         ws.recv(&mut payload)?;
+        let payload = &payload[..payload_len];
+
+        let parsed = if is_text {
+            let body = match core::str::from_utf8(payload) {
+                Ok(body) => body,
+                Err(err) => {
+                    warn!("Received non UTF-8 WebSocket payload: {err:?}");
+                    ws.send(FrameType::Text(false), b"{\"error\":\"invalid_utf8\"}")?;
+                    return Ok(());
+                }
+            };
 
-        let body = match core::str::from_utf8(&payload[..payload_len]) {
-            Ok(body) => body,
-            Err(err) => {
-                warn!("Received non UTF-8 WebSocket payload: {err:?}");
-                ws.send(FrameType::Text(false), b"{\"error\":\"invalid_utf8\"}")?;
-                return Ok(());
-            }
+            info!("Received WebSocket payload len {}", body.len());
+            parse_pixels(body)
+        } else {
+            info!("Received binary WebSocket payload len {}", payload.len());
+            decode_frame(payload)
         };
 
-        info!("Received WebSocket payload len {}", body.len());
-
-        match parse_pixels(body) {
+        match parsed {
             Ok(pixels) => {
                 if let Err(err) = params_sender.send(pixels) {
                     warn!("Pixel queue disconnected: {err:?}");
@@ -194,3 +196,37 @@ fn parse_pixels(body: &str) -> Result<Vec<Rgb>> {
     let parsed: Vec<PixelInput> = serde_json::from_str(body)?;
     Ok(parsed.into_iter().map(Into::into).collect())
 }
+
+/// Decodes a binary message, which carries exactly one frame. A raw frame is
+/// a pixel count byte followed by that many `r, g, b` triplets; a run-length
+/// encoded frame is `RLE_FLAG | run_count` followed by that many
+/// `length, r, g, b` runs. A frame is rejected if bytes are left over after
+/// it, or before expansion if it would decode to more than `MAX_FRAME_PIXELS`.
+fn decode_frame(payload: &[u8]) -> Result<Vec<Rgb>> {
+    let (&header, body) = payload
+        .split_first()
+        .ok_or_else(|| anyhow!("empty binary frame"))?;
+    let encoded = header & RLE_FLAG != 0;
+    let stride = if encoded { 4 } else { 3 };
+    let len = usize::from(header & !RLE_FLAG) * stride;
+    if body.len() != len {
+        return Err(anyhow!(
+            "binary frame body is {} bytes, header says {len}",
+            body.len()
+        ));
+    }
+    if !encoded {
+        return Ok(body
+            .chunks_exact(3)
+            .map(|rgb| Rgb::new(rgb[0], rgb[1], rgb[2]))
+            .collect());
+    }
+    let count: usize = body.chunks_exact(4).map(|run| usize::from(run[0])).sum();
+    if count > MAX_FRAME_PIXELS {
+        return Err(anyhow!("binary frame decodes to {count} pixels"));
+    }
+    Ok(body
+        .chunks_exact(4)
+        .flat_map(|run| iter::repeat(Rgb::new(run[1], run[2], run[3])).take(usize::from(run[0])))
+        .collect())
+}